@@ -4,21 +4,64 @@ Store your API keys and settings here
 """
 
 import os
+import json
 from pathlib import Path
 
-# Load .env file if it exists
-env_file = Path(__file__).parent / '.env'
-if env_file.exists():
+
+def parse_env_file(env_file: Path) -> dict:
+    """Parse KEY=value lines from a .env file"""
+    env = {}
     with open(env_file) as f:
         for line in f:
             line = line.strip()
             if line and not line.startswith('#') and '=' in line:
                 key, value = line.split('=', 1)
-                os.environ[key.strip()] = value.strip()
+                env[key.strip()] = value.strip()
+    return env
+
+
+def load_env_file(env_file: Path):
+    """
+    Load a .env file into os.environ
+    The parsed values are cached in a JSON file next to it, together with the
+    .env file's mtime and size, and reused only while both match exactly
+    """
+    env_cache = env_file.with_name('.env.cache.json')
+    stat = env_file.stat()
+    signature = [stat.st_mtime_ns, stat.st_size]
+    env = None
+
+    try:
+        cached = json.loads(env_cache.read_text())
+        if cached['signature'] == signature:
+            env = cached['env']
+    except (OSError, ValueError, KeyError, TypeError):
+        env = None
+
+    if env is None:
+        env = parse_env_file(env_file)
+        try:
+            # The values include API keys, so the cache is only readable by its owner
+            fd = os.open(env_cache, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'signature': signature, 'env': env}, f)
+        except OSError:
+            pass
+
+    os.environ.update(env)
+
+
+# Load .env file if it exists (once per process tree; child processes
+# inherit the environment)
+env_file = Path(__file__).parent / '.env'
+if not os.environ.get('_CONFIG_LOADED') and env_file.exists():
+    load_env_file(env_file)
+    os.environ['_CONFIG_LOADED'] = '1'
 
 # DeepSeek API Configuration
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', 'your-api-key-here')
-DEEPSEEK_API_URL = 'https://api.deepseek.com/v1/chat/completions'
+DEEPSEEK_API_BASE = 'https://api.deepseek.com/v1'
+DEEPSEEK_API_URL = f'{DEEPSEEK_API_BASE}/chat/completions'
 DEEPSEEK_MODEL = 'deepseek-chat'
 
 # Processing Settings
@@ -26,6 +69,22 @@ MAX_RETRIES = 3
 RETRY_DELAY = 1  # seconds
 TEMPERATURE = 0.1  # Low temperature for consistent extraction
 REQUEST_TIMEOUT = 30  # seconds
+MAX_TOKENS_PER_REPORT = 256  # output token cap per report (the JSON needs ~150)
+BATCH_SIZE = 10  # narratives sent per LLM request
+MAX_WORKERS = 20  # concurrent LLM requests
+MAX_RPM = 300  # LLM requests per minute (0 = unlimited)
+BATCH_POLL_INTERVAL = 30  # seconds between batch API status checks
+CACHE_DIR = '~/.cache/crime_extractor'  # on-disk cache of LLM extractions
+
+# Narratives shorter than this only get regex extraction, never the LLM
+MIN_NARRATIVE_LENGTH = 30
+
+# Crime codes whose reports usually describe suspects; the LLM is always
+# asked for suspects on these rows
+SUSPECT_CRIME_CODES = {'110', '113', '122', '210', '220', '230', '236', '420', '459', '624', '647', '653', '664'}
+
+# Vehicle crime codes; rows go to the LLM unless regex found vehicle details
+VEHICLE_CRIME_CODES = {'330', '450', '451', '510'}
 
 # Input/Output Paths
 INPUT_DIR = 'input'
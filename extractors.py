@@ -4,38 +4,192 @@ Includes both regex-based and LLM-based extraction methods
 """
 
 import re
-import json
 import time
+import random
+import hashlib
+import threading
+from pathlib import Path
+import diskcache
+import orjson
 import requests
-from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional, Tuple
 import config
 
+try:
+    import hyperscan  # Optional: single-pass multi-pattern scanning for the regex fallback
+except ImportError:
+    hyperscan = None
+
 
 # ============================================================================
 # REGEX-BASED EXTRACTION (Fallback and Fast Operations)
 # ============================================================================
 
-def extract_entry_method_regex(narrative: str) -> str:
+# Entry method patterns, checked in order
+ENTRY_METHODS = {
+    'window_smash': r'(broke|smashed|shattered|broken).{0,15}(window|glass)',
+    'door_pry': r'(pried|forced|jimmied|pry).{0,15}(door|entry)',
+    'door_kick': r'(kicked|boot|kick).{0,15}door',
+    'lock_pick': r'(picked|pick).{0,15}lock',
+    'unlocked': r'(unlocked|open|unsecured).{0,15}(door|window|entry)',
+    'cut_screen': r'(cut|sliced).{0,15}(screen|mesh)',
+    'garage_door': r'(garage|overhead).{0,15}door',
+    'unknown': r'(unknown|undetermined).{0,15}(entry|method|access)'
+}
+
+# Common license plate patterns
+PLATE_PATTERNS = [
+    r'\b[A-Z]{2,3}[-\s]?[0-9]{3,4}\b',  # ABC123, AB-1234
+    r'\b[0-9][A-Z]{2,3}[-\s]?[0-9]{3}\b',  # 1ABC234
+    r'\b[A-Z]{3}[-\s]?[0-9]{4}\b',  # ABC-1234
+]
+
+# Common car makes
+VEHICLE_MAKES = [
+    'honda', 'toyota', 'ford', 'chevrolet', 'chevy', 'nissan',
+    'bmw', 'mercedes', 'tesla', 'hyundai', 'kia', 'mazda',
+    'dodge', 'jeep', 'ram', 'gmc', 'volkswagen', 'vw', 'audi',
+    'lexus', 'acura', 'infiniti', 'subaru', 'volvo'
+]
+
+# Common colors
+VEHICLE_COLORS = [
+    'black', 'white', 'red', 'blue', 'silver', 'grey', 'gray',
+    'green', 'yellow', 'orange', 'brown', 'tan', 'beige',
+    'gold', 'maroon', 'purple'
+]
+
+# Compiled once at import time instead of on every narrative
+_ENTRY_PATTERNS = [
+    (method.replace('_', ' '), re.compile(pattern, re.IGNORECASE))
+    for method, pattern in ENTRY_METHODS.items()
+]
+_PLATE_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in PLATE_PATTERNS]
+
+
+def _word_alternation(words: List[str]) -> re.Pattern:
+    """Compile a list of words into one whole-word alternation (longest first)"""
+    alternatives = '|'.join(map(re.escape, sorted(words, key=len, reverse=True)))
+    return re.compile(r'\b(' + alternatives + r')\b', re.IGNORECASE)
+
+
+# Makes and colors are each matched in a single scan; the ranks keep the
+# list order as the tie-breaker when a narrative mentions several
+_MAKES_RE = _word_alternation(VEHICLE_MAKES)
+_COLORS_RE = _word_alternation(VEHICLE_COLORS)
+_MAKE_RANKS = {make: rank for rank, make in enumerate(VEHICLE_MAKES)}
+_COLOR_RANKS = {color: rank for rank, color in enumerate(VEHICLE_COLORS)}
+
+
+def _best_word_match(pattern: re.Pattern, ranks: Dict[str, int], narrative: str) -> Optional[str]:
+    """Return the highest-ranked word found by a word alternation, title-cased"""
+    found = {match.group(1).casefold() for match in pattern.finditer(narrative)}
+    if not found:
+        return None
+    return min(found, key=lambda word: ranks.get(word, len(ranks))).title()
+
+
+def _ucp_word_boundaries(pattern: str) -> str:
     """
-    Extract method of entry using regex patterns
-    Returns the first matching method or 'Not specified'
+    Rewrite a pattern's leading and trailing \b for Hyperscan, which rejects
+    \b in UCP mode. Every such pattern here starts and ends with a word
+    character, so the boundary is the start/end of the text or a non-word
+    character. Consuming that character doesn't matter, since only the
+    presence of a match is used.
+    """
+    if pattern.startswith(r'\b'):
+        pattern = r'(?:^|\W)' + pattern[2:]
+    if pattern.endswith(r'\b'):
+        pattern = pattern[:-2] + r'(?:\W|$)'
+    return pattern
+
+
+def _build_scan_database():
+    """
+    Compile every entry, make, color and plate pattern into one Hyperscan
+    database so a narrative can be checked against all of them in a single
+    pass. Returns None when Hyperscan is not installed.
+    """
+    if hyperscan is None:
+        return None
+
+    expressions = (
+        list(ENTRY_METHODS.values())
+        + [_ucp_word_boundaries(r'\b' + re.escape(make) + r'\b') for make in VEHICLE_MAKES]
+        + [_ucp_word_boundaries(r'\b' + re.escape(color) + r'\b') for color in VEHICLE_COLORS]
+        + [_ucp_word_boundaries(pattern) for pattern in PLATE_PATTERNS]
+    )
+    # Presence is all we need, so report each pattern at most once. UCP gives
+    # \w Unicode semantics, matching Python's re
+    flags = (hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+             | hyperscan.HS_FLAG_SINGLEMATCH)
+
+    database = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+    database.compile(
+        expressions=[expression.encode('utf-8') for expression in expressions],
+        ids=list(range(len(expressions))),
+        flags=[flags] * len(expressions)
+    )
+    return database
+
+
+_SCAN_DATABASE = _build_scan_database()
+
+# Id ranges of each pattern group inside the scan database
+_MAKE_IDS_START = len(ENTRY_METHODS)
+_COLOR_IDS_START = _MAKE_IDS_START + len(VEHICLE_MAKES)
+_PLATE_IDS_START = _COLOR_IDS_START + len(VEHICLE_COLORS)
+
+
+def _scan_narrative(narrative: str) -> Tuple[str, Dict[str, Optional[str]]]:
     """
-    entry_methods = {
-        'window_smash': r'(broke|smashed|shattered|broken).{0,15}(window|glass)',
-        'door_pry': r'(pried|forced|jimmied|pry).{0,15}(door|entry)',
-        'door_kick': r'(kicked|boot|kick).{0,15}door',
-        'lock_pick': r'(picked|pick).{0,15}lock',
-        'unlocked': r'(unlocked|open|unsecured).{0,15}(door|window|entry)',
-        'cut_screen': r'(cut|sliced).{0,15}(screen|mesh)',
-        'garage_door': r'(garage|overhead).{0,15}door',
-        'unknown': r'(unknown|undetermined).{0,15}(entry|method|access)'
+    Hyperscan version of the entry method and vehicle extractors
+    Returns (method of entry, vehicle dict) exactly as the regex functions would
+    """
+    matched = set()
+
+    def on_match(pattern_id, start, end, flags, context):
+        matched.add(pattern_id)
+
+    _SCAN_DATABASE.scan(narrative.encode('utf-8', 'replace'), match_event_handler=on_match)
+
+    # Lowest id in each group wins, mirroring the order of the pattern lists
+    def first_in_group(start: int, end: int) -> Optional[int]:
+        return min((pattern_id - start for pattern_id in matched if start <= pattern_id < end), default=None)
+
+    entry = first_in_group(0, _MAKE_IDS_START)
+    make = first_in_group(_MAKE_IDS_START, _COLOR_IDS_START)
+    color = first_in_group(_COLOR_IDS_START, _PLATE_IDS_START)
+    plate = first_in_group(_PLATE_IDS_START, _PLATE_IDS_START + len(PLATE_PATTERNS))
+
+    vehicle = {
+        'make': VEHICLE_MAKES[make].title() if make is not None else None,
+        'model': None,
+        'color': VEHICLE_COLORS[color].title() if color is not None else None,
+        'plate': None
     }
 
-    narrative_lower = narrative.lower()
+    # Hyperscan only reports where a match ends; re-run the one plate pattern
+    # that matched to get the plate text itself
+    if plate is not None:
+        match = _PLATE_PATTERNS[plate].search(narrative)
+        if match:
+            vehicle['plate'] = match.group(0).upper().replace(' ', '').replace('-', '')
+
+    method = _ENTRY_PATTERNS[entry][0] if entry is not None else 'Not specified'
+
+    return method, vehicle
+
 
-    for method, pattern in entry_methods.items():
-        if re.search(pattern, narrative_lower):
-            return method.replace('_', ' ')
+def extract_entry_method_regex(narrative: str) -> str:
+    """
+    Extract method of entry using regex patterns
+    Returns the first matching method or 'Not specified'
+    """
+    for method, pattern in _ENTRY_PATTERNS:
+        if pattern.search(narrative):
+            return method
 
     return 'Not specified'
 
@@ -45,17 +199,10 @@ def extract_license_plate_regex(narrative: str) -> Optional[str]:
     Extract license plate using common patterns
     Supports formats like: ABC123, 1ABC234, AB-1234, etc.
     """
-    # Common license plate patterns
-    patterns = [
-        r'\b[A-Z]{2,3}[-\s]?[0-9]{3,4}\b',  # ABC123, AB-1234
-        r'\b[0-9][A-Z]{2,3}[-\s]?[0-9]{3}\b',  # 1ABC234
-        r'\b[A-Z]{3}[-\s]?[0-9]{4}\b',  # ABC-1234
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, narrative.upper())
+    for pattern in _PLATE_PATTERNS:
+        match = pattern.search(narrative)
         if match:
-            return match.group(0).replace(' ', '').replace('-', '')
+            return match.group(0).upper().replace(' ', '').replace('-', '')
 
     return None
 
@@ -72,34 +219,11 @@ def extract_vehicle_regex(narrative: str) -> Dict[str, Optional[str]]:
         'plate': None
     }
 
-    # Common car makes
-    makes = [
-        'honda', 'toyota', 'ford', 'chevrolet', 'chevy', 'nissan',
-        'bmw', 'mercedes', 'tesla', 'hyundai', 'kia', 'mazda',
-        'dodge', 'jeep', 'ram', 'gmc', 'volkswagen', 'vw', 'audi',
-        'lexus', 'acura', 'infiniti', 'subaru', 'volvo'
-    ]
-
-    # Common colors
-    colors = [
-        'black', 'white', 'red', 'blue', 'silver', 'grey', 'gray',
-        'green', 'yellow', 'orange', 'brown', 'tan', 'beige',
-        'gold', 'maroon', 'purple'
-    ]
-
-    narrative_lower = narrative.lower()
-
     # Extract make
-    for make in makes:
-        if re.search(r'\b' + make + r'\b', narrative_lower):
-            result['make'] = make.title()
-            break
+    result['make'] = _best_word_match(_MAKES_RE, _MAKE_RANKS, narrative)
 
     # Extract color
-    for color in colors:
-        if re.search(r'\b' + color + r'\b', narrative_lower):
-            result['color'] = color.title()
-            break
+    result['color'] = _best_word_match(_COLORS_RE, _COLOR_RANKS, narrative)
 
     # Extract plate
     result['plate'] = extract_license_plate_regex(narrative)
@@ -107,123 +231,747 @@ def extract_vehicle_regex(narrative: str) -> Dict[str, Optional[str]]:
     return result
 
 
+# Words that suggest a narrative mentions suspects or vehicles
+SUSPECT_WORDS = [
+    r'S\d', r'susp\w*', r'subj\w*', r'perps?', r'perpetrators?', r'[WBHA]/[MF]',
+    r'males?', r'females?', r'm[ae]n', r'wom[ae]n', r'persons?', r'people', r'juveniles?',
+    r'teens?', r'boys?', r'girls?', r'caretakers?', r'guests?', r'roommates?', r'neighbou?rs?',
+    r'(boy|girl)friends?', r'hoodie', r'ft', r'tall'
+]
+
+_SUSPECT_HINT = re.compile(r'\b(' + '|'.join(SUSPECT_WORDS) + r')\b', re.IGNORECASE)
+
+VEHICLE_WORDS = [
+    r'vehicles?', r'cars?', r'autos?', r'trucks?', r'vans?', r'minivans?', r'suvs?', r'sedans?',
+    r'coupes?', r'convertibles?', r'hatchbacks?', r'pickups?', r'motorcycles?', r'plates?'
+]
+
+_VEHICLE_HINT = re.compile(
+    r'\b(' + '|'.join(VEHICLE_WORDS + [re.escape(make) for make in VEHICLE_MAKES]) + r')\b',
+    re.IGNORECASE
+)
+
+
+def _narrative_hints(narrative: str) -> Tuple[bool, bool]:
+    """Return whether a narrative may mention (suspects, vehicles)"""
+    return _SUSPECT_HINT.search(narrative) is not None, _VEHICLE_HINT.search(narrative) is not None
+
+
+# Entry and crime words that suggest a narrative has something to extract,
+# on top of the suspect and vehicle hints
+TRIGGER_WORDS = [
+    r'doors?', r'windows?', r'glass', r'screens?', r'locks?', r'locked', r'unlocked', r'garage',
+    r'entry', r'enter(ed)?', r'broke', r'broken', r'smash\w*', r'shatter\w*',
+    r'pr(y|ied)', r'forced', r'kick\w*', r'steal\w*', r'stole', r'stolen', r'took', r'taken',
+    r'theft', r'burglar\w*', r'robb\w*', r'assault\w*', r'punch\w*', r'grabb?\w*', r'missing',
+    r'fled', r'ran', r'threat\w*', r'weapon', r'vandal\w*'
+]
+
+_TRIGGER_RE = re.compile(r'\b(' + '|'.join(TRIGGER_WORDS) + r')\b', re.IGNORECASE)
+
+
+def is_trivial_narrative(narrative: str) -> bool:
+    """
+    Check whether a narrative is a stub with nothing to extract
+    (e.g. 'Report pending', 'See supplemental'): short, and without any
+    entry, crime, suspect or vehicle word
+    """
+    if len(narrative) >= config.MIN_NARRATIVE_LENGTH:
+        return False
+    suspects, vehicles = _narrative_hints(narrative)
+    return not (suspects or vehicles or _TRIGGER_RE.search(narrative))
+
+
+def empty_extraction() -> Dict:
+    """Extraction result for a narrative with nothing to extract"""
+    return {
+        'method_of_entry': 'Not specified',
+        'suspects': [],
+        'vehicles': []
+    }
+
+
 def fallback_regex_extraction(narrative: str) -> Dict:
     """
     Complete fallback extraction using only regex
     Used when LLM API is unavailable
     """
-    vehicle = extract_vehicle_regex(narrative)
+    if _SCAN_DATABASE is not None:
+        method, vehicle = _scan_narrative(narrative)
+    else:
+        method = extract_entry_method_regex(narrative)
+        vehicle = extract_vehicle_regex(narrative)
 
     return {
-        'method_of_entry': extract_entry_method_regex(narrative),
+        'method_of_entry': method,
         'suspects': [],  # Regex not reliable for suspect extraction
         'vehicles': [vehicle] if any(vehicle.values()) else []
     }
 
 
+def llm_fallback_extraction(narrative: str) -> Dict:
+    """
+    Regex extraction standing in for a failed LLM extraction
+    Marked with 'llm_failed' so callers can tell it apart from an LLM result
+    and try the LLM again on a later run
+    """
+    extracted = fallback_regex_extraction(narrative)
+    extracted['llm_failed'] = True
+    return extracted
+
+
+def needs_llm(regex_result: Dict, crime_code: str, narrative: str) -> bool:
+    """
+    Decide whether a regex extraction is good enough to skip the LLM
+    Escalates when no entry method was found, when the narrative mentions
+    suspects (which regex can't extract), or when a vehicle crime has no
+    vehicle details
+    """
+    if regex_result['method_of_entry'] == 'Not specified':
+        return True
+    if _SUSPECT_HINT.search(narrative):
+        return True
+    if crime_code in config.VEHICLE_CRIME_CODES and not regex_result['vehicles']:
+        return True
+    return False
+
+
 # ============================================================================
 # LLM-BASED EXTRACTION (Primary Method - Higher Accuracy)
 # ============================================================================
 
-def extract_with_llm(narrative: str, crime_code: str) -> Dict:
+_METHOD_SCHEMA = '''"method_of_entry": "string (e.g., 'window smash', 'door pry', 'unlocked', 'unknown')"'''
+
+_SUSPECTS_SCHEMA = """"suspects": [
+    {"id": "S1", "description": "brief physical description"},
+    {"id": "S2", "description": "brief physical description"}
+  ]"""
+
+_VEHICLES_SCHEMA = """"vehicles": [
+    {"make": "string or null", "model": "string or null", "color": "string or null", "plate": "string or null"}
+  ]"""
+
+
+def _extraction_schema(suspects: bool = True, vehicles: bool = True) -> str:
+    """JSON schema for the requested fields; method_of_entry is always included"""
+    fields = [_METHOD_SCHEMA]
+    if suspects:
+        fields.append(_SUSPECTS_SCHEMA)
+    if vehicles:
+        fields.append(_VEHICLES_SCHEMA)
+    return '{\n  ' + ',\n  '.join(fields) + '\n}'
+
+
+def _extraction_rules(suspects: bool = True, vehicles: bool = True) -> str:
+    """Extraction rules for the requested fields"""
+    rules = [
+        "Rules:",
+        "- If information is not mentioned, use null",
+        "- Keep descriptions brief (under 20 words)"
+    ]
+    if suspects:
+        rules.append("- Only include suspects explicitly mentioned (look for S1, S2, Subject 1, Subject 2, Suspect 1, etc.)")
+    if vehicles:
+        rules.append("- Extract vehicle details even if partial (e.g., just color and make)")
+    rules.append("- For method_of_entry, choose from: window smash, door pry, door kick, unlocked, cut screen, garage door, unknown, or describe briefly")
+    return '\n'.join(rules)
+
+
+EXTRACTION_SCHEMA = _extraction_schema()
+
+EXTRACTION_RULES = _extraction_rules()
+
+class RateLimiter:
     """
-    Extract structured information using DeepSeek LLM
-    Returns dict with method_of_entry, suspects, and vehicles
+    Thread-safe limiter that spaces requests evenly to stay under a
+    requests-per-minute budget (0 disables limiting)
     """
-    prompt = f"""You are extracting structured information from a police crime report narrative.
 
-Crime Code: {crime_code}
-Narrative: {narrative}
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the caller may send its next request"""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Settings read once at import instead of on every request
+_API_URL = config.DEEPSEEK_API_URL
+_API_BASE = config.DEEPSEEK_API_BASE
+_MODEL = config.DEEPSEEK_MODEL
+_TEMPERATURE = config.TEMPERATURE
+_TIMEOUT = config.REQUEST_TIMEOUT
+_MAX_RETRIES = config.MAX_RETRIES
+_RETRY_DELAY = config.RETRY_DELAY
+_BATCH_POLL_INTERVAL = config.BATCH_POLL_INTERVAL
+_MAX_TOKENS_PER_REPORT = config.MAX_TOKENS_PER_REPORT
+
+_RATE_LIMITER = RateLimiter(config.MAX_RPM)
+
+# One pooled keep-alive session for all API calls, so TLS handshakes are
+# only paid once per connection instead of once per request
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0))
+_SESSION.headers['Authorization'] = f'Bearer {config.DEEPSEEK_API_KEY}'
+
+# Request bodies are serialized with orjson, so the content type is set by hand
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def _chat_body(messages: List[Dict], max_tokens: int, stream: bool = False) -> Dict:
+    """
+    Build the chat completion request body for a list of messages
+    JSON mode guarantees a bare JSON object back (no markdown fences), and
+    max_tokens caps how long a runaway response can take
+    """
+    return {
+        'model': _MODEL,
+        'messages': messages,
+        'temperature': _TEMPERATURE,
+        'max_tokens': max_tokens,
+        'response_format': {'type': 'json_object'},
+        'stream': stream
+    }
+
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class _RetryableError(Exception):
+    """Transient API failure (rate limit, server or network error)"""
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given (0-based) attempt"""
+    return _RETRY_DELAY * 2 ** attempt + random.random()
+
+
+def _read_json_stream(response: requests.Response):
+    """
+    Collect the streamed content deltas of a chat completion and parse them
+    as JSON. Stops reading early if the model keeps generating text after a
+    complete JSON value.
+    """
+    parts = []
+    parsed = None
+
+    for line in response.iter_lines():
+        if not line.startswith(b'data: '):
+            continue
+        data = line[len(b'data: '):]
+        if data == b'[DONE]':
+            break
+
+        choices = orjson.loads(data).get('choices') or [{}]
+        content = (choices[0].get('delta') or {}).get('content')
+        if not content:
+            continue
+
+        if parsed is not None:
+            if content.strip():
+                break  # Extra output after the JSON; no need to wait for it
+            continue
+
+        parts.append(content)
+        if content.rstrip().endswith(('}', ']')):
+            try:
+                parsed = orjson.loads(''.join(parts))
+            except orjson.JSONDecodeError:
+                pass  # Not complete yet
+
+    if parsed is None:
+        # Raises for truncated or malformed output
+        parsed = orjson.loads(''.join(parts))
+
+    return parsed
+
+
+def _request_llm(messages: List[Dict], max_tokens: int):
+    """
+    Send chat messages to DeepSeek and return the parsed JSON response
+    Raises _RetryableError for failures that may succeed on a later attempt
+    """
+    _RATE_LIMITER.wait()
+
+    try:
+        with _SESSION.post(
+            _API_URL,
+            data=orjson.dumps(_chat_body(messages, max_tokens, stream=True)),
+            headers=_JSON_HEADERS,
+            timeout=_TIMEOUT,
+            stream=True
+        ) as response:
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                raise _RetryableError(f"LLM request failed: HTTP {response.status_code}")
+            response.raise_for_status()
+
+            return _read_json_stream(response)
+
+    except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+        raise _RetryableError(f"LLM request failed: {e}") from e
+
+
+def _normalize_extraction(extracted_data: Dict) -> Dict:
+    """Validate a single extracted record and fill in missing keys"""
+    if not isinstance(extracted_data, dict):
+        raise ValueError("LLM did not return a valid JSON object")
+
+    # Ensure required keys exist
+    if 'method_of_entry' not in extracted_data:
+        extracted_data['method_of_entry'] = None
+    if 'suspects' not in extracted_data:
+        extracted_data['suspects'] = []
+    if 'vehicles' not in extracted_data:
+        extracted_data['vehicles'] = []
+
+    return extracted_data
+
+
+def _prompt_prefix(suspects: bool, vehicles: bool) -> str:
+    return f"""You are extracting structured information from a police crime report narrative.
 
 Extract the following information and return ONLY valid JSON (no markdown, no explanation):
 
-{{
-  "method_of_entry": "string (e.g., 'window smash', 'door pry', 'unlocked', 'unknown')",
-  "suspects": [
-    {{"id": "S1", "description": "brief physical description"}},
-    {{"id": "S2", "description": "brief physical description"}}
-  ],
-  "vehicles": [
-    {{"make": "string or null", "model": "string or null", "color": "string or null", "plate": "string or null"}}
-  ]
-}}
-
-Rules:
-- If information is not mentioned, use null
-- Keep descriptions brief (under 20 words)
-- Only include suspects explicitly mentioned (look for S1, S2, Subject 1, Subject 2, Suspect 1, etc.)
-- Extract vehicle details even if partial (e.g., just color and make)
-- For method_of_entry, choose from: window smash, door pry, door kick, unlocked, cut screen, garage door, unknown, or describe briefly
+{_extraction_schema(suspects, vehicles)}
+
+{_extraction_rules(suspects, vehicles)}
+- Return ONLY the JSON object, no markdown formatting"""
+
+
+def _batch_prompt_prefix(suspects: bool, vehicles: bool) -> str:
+    return f"""You are extracting structured information from several police crime report narratives, numbered [1], [2], and so on.
+
+Return a JSON object {{"reports": [...]}} whose "reports" array holds one object per report, in the same order as the reports.
+
+Each object must have this structure. Return ONLY valid JSON (no markdown, no explanation):
+
+{_extraction_schema(suspects, vehicles)}
+
+{_extraction_rules(suspects, vehicles)}
 - Return ONLY the JSON object, no markdown formatting"""
 
+
+# The fixed instructions go first, in the system message, and only the report
+# itself varies at the end of each request. Every request then starts with one
+# of these few prefixes (keyed by whether suspects and vehicles are asked for),
+# which the server can serve from its prompt (KV) cache.
+_PROMPT_PREFIXES = {
+    (suspects, vehicles): _prompt_prefix(suspects, vehicles)
+    for suspects in (True, False) for vehicles in (True, False)
+}
+
+_BATCH_PROMPT_PREFIXES = {
+    (suspects, vehicles): _batch_prompt_prefix(suspects, vehicles)
+    for suspects in (True, False) for vehicles in (True, False)
+}
+
+# Changes whenever a prompt changes, so cached extractions made with an older
+# prompt aren't reused
+_PROMPT_VERSION = hashlib.sha256(
+    '\x00'.join(sorted(_PROMPT_PREFIXES.values()) + sorted(_BATCH_PROMPT_PREFIXES.values())).encode('utf-8')
+).hexdigest()[:16]
+
+
+def _prompt_fields(narrative: str, crime_code: str) -> Tuple[bool, bool]:
+    """
+    Return whether to ask the LLM for (suspects, vehicles)
+    Always asked for on crime codes that usually involve them; otherwise only
+    if the narrative hints at them. The hint lists can't name every make or
+    way of describing a person, so they only shorten the prompt and never
+    discard what the model returns.
+    """
+    suspects, vehicles = _narrative_hints(narrative)
+    return (
+        suspects or crime_code in config.SUSPECT_CRIME_CODES,
+        vehicles or crime_code in config.VEHICLE_CRIME_CODES
+    )
+
+
+def build_extraction_messages(narrative: str, crime_code: str) -> List[Dict]:
+    """Build the chat messages for a single-report extraction"""
+    return [
+        {'role': 'system', 'content': _PROMPT_PREFIXES[_prompt_fields(narrative, crime_code)]},
+        {'role': 'user', 'content': f"Crime Code: {crime_code}\nNarrative: {narrative}"}
+    ]
+
+
+def build_batch_messages(pairs: List[Tuple[str, str]]) -> List[Dict]:
+    """
+    Build the chat messages for a batched extraction of (crime_code, narrative) pairs
+    Suspects and vehicles are asked for if any report in the batch may mention them
+    """
+    reports = '\n\n'.join(
+        f"[{i}] Crime Code: {crime_code}\nNarrative: {narrative}"
+        for i, (crime_code, narrative) in enumerate(pairs, 1)
+    )
+    wanted = [_prompt_fields(narrative, crime_code) for crime_code, narrative in pairs]
+    fields = (any(suspects for suspects, _ in wanted), any(vehicles for _, vehicles in wanted))
+
+    return [
+        {'role': 'system', 'content': _BATCH_PROMPT_PREFIXES[fields]},
+        {'role': 'user', 'content': f"{len(pairs)} reports:\n\n{reports}"}
+    ]
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+_CACHE_READS = True
+_CACHE_FAILED = False
+
+
+def _cache_error(error: Exception):
+    """
+    Report a cache failure (unwritable directory, full disk, locked database)
+    The cache is only an optimization, so extraction carries on without it;
+    only the first failure is printed
+    """
+    global _CACHE_FAILED
+    with _CACHE_LOCK:
+        if _CACHE_FAILED:
+            return
+        _CACHE_FAILED = True
+    print(f"⚠️  Extraction cache unavailable: {error}")
+    print("   Continuing without it...")
+
+
+def _get_cache() -> Optional[diskcache.Cache]:
+    """
+    Open the on-disk extraction cache the first time it is needed
+    Returns None if the cache can't be opened
+    """
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            try:
+                _CACHE = diskcache.Cache(
+                    str(Path(config.CACHE_DIR).expanduser()),
+                    eviction_policy='least-recently-used'
+                )
+            except Exception as e:
+                # Not retried on later calls
+                _CACHE = e
+        cache = _CACHE
+
+    if isinstance(cache, Exception):
+        _cache_error(cache)
+        return None
+    return cache
+
+
+def _cache_key(narrative: str, crime_code: str) -> str:
+    """Key a cached extraction by model and prompt version as well as by its inputs"""
+    key = '\x00'.join([_MODEL, _PROMPT_VERSION, crime_code, narrative])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _cache_get(narrative: str, crime_code: str) -> Optional[Dict]:
+    """Return a previously cached LLM extraction, or None"""
+    if not _CACHE_READS:
+        return None
+    cache = _get_cache()
+    if cache is None:
+        return None
     try:
-        response = requests.post(
-            config.DEEPSEEK_API_URL,
-            headers={
-                'Authorization': f'Bearer {config.DEEPSEEK_API_KEY}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': config.DEEPSEEK_MODEL,
-                'messages': [{'role': 'user', 'content': prompt}],
-                'temperature': config.TEMPERATURE
-            },
-            timeout=config.REQUEST_TIMEOUT
-        )
+        return cache.get(_cache_key(narrative, crime_code))
+    except Exception as e:
+        _cache_error(e)
+        return None
 
-        response.raise_for_status()
-        result = response.json()['choices'][0]['message']['content']
 
-        # Clean potential markdown formatting
-        result = result.strip()
-        result = re.sub(r'^```json\s*', '', result)
-        result = re.sub(r'^```\s*', '', result)
-        result = re.sub(r'\s*```$', '', result)
+def _cache_set(narrative: str, crime_code: str, extracted: Dict):
+    cache = _get_cache()
+    if cache is None:
+        return
+    try:
+        cache.set(_cache_key(narrative, crime_code), extracted)
+    except Exception as e:
+        _cache_error(e)
+
 
-        # Parse JSON
-        extracted_data = json.loads(result)
+def set_cache_reads(enabled: bool):
+    """
+    Turn cache lookups on or off
+    With lookups off every report goes to the LLM again, but fresh results are
+    still written to the cache
+    """
+    global _CACHE_READS
+    _CACHE_READS = enabled
+
+
+def extract_with_llm(narrative: str, crime_code: str) -> Dict:
+    """
+    Extract structured information using DeepSeek LLM
+    Returns dict with method_of_entry, suspects, and vehicles
+    Successful extractions are cached on disk, keyed by model, prompt version,
+    crime code and narrative
+    """
+    extracted = _cache_get(narrative, crime_code)
+    if extracted is None:
+        extracted = _extract_with_llm_raw(narrative, crime_code)
+        _cache_set(narrative, crime_code, extracted)
+    return extracted
 
-        # Validate structure
-        if not isinstance(extracted_data, dict):
-            raise ValueError("LLM did not return a valid JSON object")
 
-        # Ensure required keys exist
-        if 'method_of_entry' not in extracted_data:
-            extracted_data['method_of_entry'] = None
-        if 'suspects' not in extracted_data:
-            extracted_data['suspects'] = []
-        if 'vehicles' not in extracted_data:
-            extracted_data['vehicles'] = []
+def _extract_with_llm_raw(narrative: str, crime_code: str) -> Dict:
+    """Uncached single-report LLM extraction"""
+    messages = build_extraction_messages(narrative, crime_code)
 
-        return extracted_data
+    try:
+        # Parse JSON
+        return _normalize_extraction(_request_llm(messages, _MAX_TOKENS_PER_REPORT))
 
+    except _RetryableError:
+        raise
     except Exception as e:
         raise Exception(f"LLM extraction failed: {str(e)}")
 
 
+def extract_with_llm_batch(pairs: List[Tuple[str, str]]) -> List[Dict]:
+    """
+    Extract structured information for several reports with one DeepSeek request
+    Takes a list of (crime_code, narrative) pairs and returns one dict per pair,
+    in the same order. Falls back to per-report extraction if the batched
+    response cannot be matched up with the input.
+    Reports already in the cache are not sent again.
+    """
+    results = [_cache_get(narrative, crime_code) for crime_code, narrative in pairs]
+    missing = [i for i, extracted in enumerate(results) if extracted is None]
+
+    for i, extracted in zip(missing, _extract_with_llm_batch_raw([pairs[i] for i in missing])):
+        results[i] = extracted
+
+    return results
+
+
+def _extract_with_llm_batch_raw(pairs: List[Tuple[str, str]]) -> List[Dict]:
+    """Uncached batched LLM extraction"""
+    if not pairs:
+        return []
+    if len(pairs) == 1:
+        crime_code, narrative = pairs[0]
+        return [extract_with_llm_safe(narrative, crime_code)]
+
+    messages = build_batch_messages(pairs)
+
+    extracted = None
+    last_error = None
+
+    for attempt in range(_MAX_RETRIES):
+        try:
+            response = _request_llm(messages, _MAX_TOKENS_PER_REPORT * len(pairs))
+            reports = response.get('reports') if isinstance(response, dict) else None
+
+            if not isinstance(reports, list):
+                raise ValueError("LLM did not return a reports array")
+            if len(reports) != len(pairs):
+                raise ValueError(f"expected {len(pairs)} results, got {len(reports)}")
+
+            extracted = [_normalize_extraction(item) for item in reports]
+            break
+        except _RetryableError as e:
+            last_error = e
+            if attempt < _MAX_RETRIES - 1:
+                time.sleep(_backoff_delay(attempt))
+        except Exception as e:
+            # A malformed response won't get better by resending the batch
+            last_error = e
+            break
+
+    if extracted is None:
+        print(f"⚠️  Batched LLM extraction failed for {len(pairs)} reports: {last_error}")
+        if isinstance(last_error, _RetryableError):
+            # The server is shedding load; sending each report separately
+            # would only multiply the requests
+            print("   Falling back to regex extraction...")
+            return [llm_fallback_extraction(narrative) for _, narrative in pairs]
+
+        print("   Retrying reports individually...")
+        return [extract_with_llm_safe(narrative, crime_code) for crime_code, narrative in pairs]
+
+    for (crime_code, narrative), item in zip(pairs, extracted):
+        _cache_set(narrative, crime_code, item)
+
+    return extracted
+
+
 def extract_with_llm_safe(narrative: str, crime_code: str, retries: int = None) -> Dict:
     """
     Wrapper for LLM extraction with retry logic and fallback
+    Only transient failures (HTTP 429/5xx, connection errors, timeouts) are
+    retried, with exponential backoff
     Returns extracted data or falls back to regex extraction
     """
     if retries is None:
-        retries = config.MAX_RETRIES
+        retries = _MAX_RETRIES
 
     last_error = None
+    attempts = 0
 
     for attempt in range(retries):
+        attempts += 1
         try:
             return extract_with_llm(narrative, crime_code)
-        except Exception as e:
+        except _RetryableError as e:
             last_error = e
             if attempt < retries - 1:
-                time.sleep(config.RETRY_DELAY)
-            continue
+                time.sleep(_backoff_delay(attempt))
+        except Exception as e:
+            # Malformed responses and client errors won't succeed on retry
+            last_error = e
+            break
 
     # If all retries failed, fallback to regex
-    print(f"⚠️  LLM extraction failed after {retries} attempts: {last_error}")
+    print(f"⚠️  LLM extraction failed after {attempts} attempt(s): {last_error}")
     print("   Falling back to regex extraction...")
-    return fallback_regex_extraction(narrative)
+    return llm_fallback_extraction(narrative)
+
+
+# ============================================================================
+# BATCH API (Offline Runs - Lower Cost, Slower Turnaround)
+# ============================================================================
+
+def submit_batch(rows: List[Tuple[int, str, str]]) -> str:
+    """
+    Submit reports to the DeepSeek batch API
+    Takes (row index, crime_code, narrative) tuples, uploads one chat completion
+    request per row as a JSONL file and returns the batch id
+    """
+    lines = [
+        orjson.dumps({
+            'custom_id': str(idx),
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': _chat_body(build_extraction_messages(narrative, crime_code), _MAX_TOKENS_PER_REPORT)
+        })
+        for idx, crime_code, narrative in rows
+    ]
+
+    upload = _SESSION.post(
+        f'{_API_BASE}/files',
+        files={'file': ('batch_input.jsonl', b'\n'.join(lines))},
+        data={'purpose': 'batch'},
+        timeout=_TIMEOUT
+    )
+    upload.raise_for_status()
+
+    batch = _SESSION.post(
+        f'{_API_BASE}/batches',
+        data=orjson.dumps({
+            'input_file_id': orjson.loads(upload.content)['id'],
+            'endpoint': '/v1/chat/completions',
+            'completion_window': '24h'
+        }),
+        headers=_JSON_HEADERS,
+        timeout=_TIMEOUT
+    )
+    batch.raise_for_status()
+
+    return orjson.loads(batch.content)['id']
+
+
+class BatchFailedError(Exception):
+    """Batch job ended without completing (failed, expired or cancelled)"""
+
+
+def wait_for_batch(batch_id: str) -> Dict:
+    """
+    Poll a batch job every BATCH_POLL_INTERVAL seconds until it finishes
+    Transient polling failures (HTTP 429/5xx, connection errors, timeouts) are
+    retried with backoff, since the job keeps running server-side either way
+    Returns the completed batch object
+    """
+    failures = 0
+
+    while True:
+        try:
+            response = _SESSION.get(
+                f'{_API_BASE}/batches/{batch_id}',
+                timeout=_TIMEOUT
+            )
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                raise _RetryableError(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            batch = orjson.loads(response.content)
+        except (_RetryableError, requests.ConnectionError, requests.Timeout) as e:
+            delay = max(_BATCH_POLL_INTERVAL, _backoff_delay(min(failures, 8)))
+            failures += 1
+            print(f"⚠️  Checking batch {batch_id} failed ({e}); retrying in {delay:.0f}s...")
+            time.sleep(delay)
+            continue
+
+        failures = 0
+        if batch['status'] == 'completed':
+            return batch
+        if batch['status'] in ['failed', 'expired', 'cancelled']:
+            raise BatchFailedError(f"Batch {batch_id} {batch['status']}")
+
+        time.sleep(_BATCH_POLL_INTERVAL)
+
+
+def cached_extractions(rows: List[Tuple[int, str, str]]) -> Dict[int, Dict]:
+    """
+    Look up (row index, crime_code, narrative) tuples in the extraction cache
+    Returns the cached extractions keyed by row index
+    """
+    results = {}
+    for idx, crime_code, narrative in rows:
+        extracted = _cache_get(narrative, crime_code)
+        if extracted is not None:
+            results[idx] = extracted
+    return results
+
+
+def download_batch_results(batch: Dict, rows: List[Tuple[int, str, str]]) -> Dict[str, Dict]:
+    """
+    Stream the output file of a completed batch
+    Takes the (row index, crime_code, narrative) tuples the batch was submitted with
+    Returns extracted data keyed by custom_id; requests that failed or returned
+    unparseable JSON are left out. Extracted data is also added to the cache.
+    A batch whose requests all failed has no output file, and yields no results.
+    """
+    if not batch.get('output_file_id'):
+        print(f"⚠️  Batch {batch.get('id')} has no output file (error file: {batch.get('error_file_id')})")
+        return {}
+
+    submitted = {str(idx): (crime_code, narrative) for idx, crime_code, narrative in rows}
+    results = {}
+
+    with _SESSION.get(
+        f"{_API_BASE}/files/{batch['output_file_id']}/content",
+        timeout=_TIMEOUT,
+        stream=True
+    ) as response:
+        response.raise_for_status()
+
+        for line in response.iter_lines():
+            if not line:
+                continue
+
+            item = orjson.loads(line)
+            result = item.get('response') or {}
+            if result.get('status_code') != 200:
+                continue
+
+            try:
+                content = result['body']['choices'][0]['message']['content']
+                crime_code, narrative = submitted[item['custom_id']]
+                extracted = _normalize_extraction(orjson.loads(content))
+            except (KeyError, IndexError, ValueError):
+                continue
+
+            results[item['custom_id']] = extracted
+            _cache_set(narrative, crime_code, extracted)
+
+    return results
 
 
 # ============================================================================
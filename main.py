@@ -12,17 +12,53 @@ Uses a hybrid approach: Regex for simple patterns + DeepSeek LLM for complex ext
 
 import pandas as pd
 import os
+import csv
+import orjson
+import xlsxwriter
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 import config
-from extractors import extract_with_llm_safe, clean_suspect_description, format_license_plate
+from extractors import (
+    extract_with_llm_batch,
+    fallback_regex_extraction,
+    llm_fallback_extraction,
+    needs_llm,
+    is_trivial_narrative,
+    empty_extraction,
+    set_cache_reads,
+    submit_batch,
+    wait_for_batch,
+    cached_extractions,
+    download_batch_results,
+    BatchFailedError,
+    clean_suspect_description,
+    format_license_plate
+)
+
+# Columns filled in by the extraction step
+EXTRACTED_COLUMNS = [
+    'method_of_entry',
+    'suspect_1',
+    'suspect_2',
+    'vehicle_make',
+    'vehicle_model',
+    'vehicle_color',
+    'vehicle_plate'
+]
+
+# Columns of the checkpoint file: row index and its extracted data as JSON.
+# The first row identifies the input file instead, under this index.
+CHECKPOINT_FIELDS = ['index', 'extracted']
+CHECKPOINT_INPUT_ROW = 'input'
 
 
 class CrimeReportExtractor:
     """Main class for processing crime reports"""
 
-    def __init__(self, input_file: str = None, output_file: str = None, crime_codes_file: str = None):
+    def __init__(self, input_file: str = None, output_file: str = None, crime_codes_file: str = None,
+                 use_batch_api: bool = False, use_cache: bool = True, batch_id: str = None):
         """
         Initialize the extractor
 
@@ -30,10 +66,24 @@ class CrimeReportExtractor:
             input_file: Path to input Excel file (default: input/crime_data.xlsx)
             output_file: Path to output Excel file (default: output/crime_data_extracted.xlsx)
             crime_codes_file: Path to crime codes CSV (default: input/crime_codes.csv)
+            use_batch_api: Submit all rows as one DeepSeek batch job instead of
+                direct requests (cheaper, but can take hours to complete)
+            use_cache: Reuse cached LLM extractions and the checkpoint of an
+                interrupted run. When False, every report is sent to the LLM
+                again and the cache is refreshed.
+            batch_id: Wait for this already submitted batch API job instead of
+                submitting a new one (implies use_batch_api)
         """
         self.input_file = input_file or os.path.join(config.INPUT_DIR, config.DEFAULT_INPUT_FILE)
         self.output_file = output_file or os.path.join(config.OUTPUT_DIR, config.DEFAULT_OUTPUT_FILE)
         self.crime_codes_file = crime_codes_file or os.path.join(config.INPUT_DIR, config.CRIME_CODES_FILE)
+        # LLM results are appended here as they complete, so an interrupted
+        # run can resume without repeating them
+        self.checkpoint_file = self.output_file + '.partial.csv'
+        self.use_batch_api = use_batch_api or batch_id is not None
+        self.batch_id = batch_id
+        self.use_cache = use_cache
+        set_cache_reads(use_cache)
 
         self.df = None
         self.crime_lookup = {}
@@ -43,7 +93,8 @@ class CrimeReportExtractor:
             'failed': 0,
             'method_extracted': 0,
             'suspects_found': 0,
-            'vehicles_found': 0
+            'vehicles_found': 0,
+            'llm_skipped': 0
         }
 
     def load_data(self):
@@ -52,11 +103,11 @@ class CrimeReportExtractor:
 
         try:
             # Load main data
-            self.df = pd.read_excel(self.input_file)
+            required_cols = [config.INPUT_COLUMNS['crime_code'], config.INPUT_COLUMNS['narrative']]
+            self.df = self.read_input([config.INPUT_COLUMNS['narrative']])
             print(f"✅ Loaded {len(self.df)} crime reports")
 
             # Validate required columns
-            required_cols = [config.INPUT_COLUMNS['crime_code'], config.INPUT_COLUMNS['narrative']]
             missing_cols = [col for col in required_cols if col not in self.df.columns]
 
             if missing_cols:
@@ -64,7 +115,8 @@ class CrimeReportExtractor:
 
             # Load crime codes
             if os.path.exists(self.crime_codes_file):
-                crime_codes_df = pd.read_csv(self.crime_codes_file)
+                # Codes are read as strings to match crime_code_strings()
+                crime_codes_df = pd.read_csv(self.crime_codes_file, dtype=str)
                 # Assume first column is code, second is description
                 code_col = crime_codes_df.columns[0]
                 desc_col = crime_codes_df.columns[1]
@@ -78,80 +130,252 @@ class CrimeReportExtractor:
             print(f"❌ Error loading data: {e}")
             sys.exit(1)
 
+    def read_input(self, string_columns: List[str]) -> pd.DataFrame:
+        """
+        Read the input workbook, with the given columns read as strings
+
+        Every column is kept, since the output carries all input columns
+        (case numbers, dates, ...) alongside the extracted ones. Uses the
+        calamine reader when python-calamine is installed, which is much
+        faster than openpyxl on large sheets.
+        """
+        dtype = {col: 'string' for col in string_columns}
+        try:
+            return pd.read_excel(self.input_file, engine='calamine', dtype=dtype)
+        except ImportError:
+            return pd.read_excel(self.input_file, engine='openpyxl', dtype=dtype)
+
     def initialize_output_columns(self):
         """Initialize all output columns in the dataframe"""
         # Map crime type
-        crime_code_col = config.INPUT_COLUMNS['crime_code']
-        self.df['crime_type'] = self.df[crime_code_col].map(self.crime_lookup)
+        self.df['crime_type'] = self.crime_code_strings().map(self.crime_lookup)
 
         # Initialize extraction columns
-        self.df['method_of_entry'] = None
-        self.df['suspect_1'] = None
-        self.df['suspect_2'] = None
-        self.df['vehicle_make'] = None
-        self.df['vehicle_model'] = None
-        self.df['vehicle_color'] = None
-        self.df['vehicle_plate'] = None
-
-    def process_row(self, idx: int, row: pd.Series) -> bool:
+        for col in EXTRACTED_COLUMNS:
+            self.df[col] = pd.Series(dtype='string', index=self.df.index)
+
+    def crime_code_strings(self) -> pd.Series:
+        """
+        The crime code column as strings, for matching against code lists
+
+        The column itself keeps the type it was read with, so numeric codes
+        stay numbers in the output. Whole-number floats (a numeric column
+        with blanks) are converted without a trailing '.0'; missing codes
+        become ''.
+        """
+        codes = self.df[config.INPUT_COLUMNS['crime_code']]
+        if pd.api.types.is_float_dtype(codes) and (codes.dropna() % 1 == 0).all():
+            codes = codes.astype('Int64')
+        return codes.astype('string').fillna('')
+
+    def get_row_inputs(self) -> List[Tuple[int, str, str]]:
+        """
+        Collect the extraction inputs for rows that have a narrative
+
+        Returns:
+            (index, crime code, narrative) for every row with a non-empty narrative
+        """
+        # Cast both columns to str once (vectorized) instead of per row;
+        # missing values become '' so empty narratives are skipped below
+        indices = self.df.index.tolist()
+        crime_codes = self.crime_code_strings().tolist()
+        narratives = self.df[config.INPUT_COLUMNS['narrative']].fillna('').astype(str).tolist()
+
+        inputs = []
+        for idx, crime_code, narrative in zip(indices, crime_codes, narratives):
+            # Only strings as short as 'none' can be placeholders, so most
+            # narratives skip the lower() copy
+            if narrative and (len(narrative) > 4 or narrative.lower() not in ['nan', 'none']):
+                inputs.append((idx, crime_code, narrative))
+
+        return inputs
+
+    def process_batch(self, inputs: List[Tuple[int, str, str]]) -> List[Tuple[int, Dict]]:
+        """
+        Extract information for a batch of rows with a single LLM request
+
+        Does not modify self.df, so batches can be processed from worker threads.
+
+        Args:
+            inputs: (index, crime code, narrative) for each row
+
+        Returns:
+            (index, extracted data) for every row
+        """
+        # Extract using LLM (with fallback to regex)
+        try:
+            extractions = extract_with_llm_batch([(crime_code, narrative) for _, crime_code, narrative in inputs])
+        except Exception as e:
+            # One failing batch must not abort the whole run
+            print(f"\n❌ Error processing batch of {len(inputs)} rows: {e}")
+            print("   Falling back to regex extraction...")
+            extractions = [llm_fallback_extraction(narrative) for _, _, narrative in inputs]
+
+        return [(idx, extracted) for (idx, _, _), extracted in zip(inputs, extractions)]
+
+    def flatten_extraction(self, extracted: Dict) -> Dict:
+        """
+        Flatten one row's extracted data into output column values
+
+        Args:
+            extracted: Extracted data (method_of_entry, suspects, vehicles)
+
+        Returns:
+            Dict keyed by EXTRACTED_COLUMNS
         """
-        Process a single row and extract information
+        values = dict.fromkeys(EXTRACTED_COLUMNS)
+
+        # Method of entry
+        if extracted.get('method_of_entry'):
+            values['method_of_entry'] = extracted['method_of_entry']
+            self.stats['method_extracted'] += 1
+
+        # Suspects
+        if extracted.get('suspects') and isinstance(extracted['suspects'], list):
+            for i, suspect in enumerate(extracted['suspects'][:2]):  # Max 2 suspects
+                if isinstance(suspect, dict) and 'description' in suspect:
+                    desc = clean_suspect_description(suspect['description'])
+                    if desc:
+                        values[f'suspect_{i+1}'] = desc
+                        if i == 0:  # Count only if at least one suspect found
+                            self.stats['suspects_found'] += 1
+
+        # Vehicles
+        if extracted.get('vehicles') and isinstance(extracted['vehicles'], list):
+            # Take first vehicle if multiple
+            for vehicle in extracted['vehicles']:
+                if isinstance(vehicle, dict) and any(vehicle.values()):
+                    values['vehicle_make'] = vehicle.get('make')
+                    values['vehicle_model'] = vehicle.get('model')
+                    values['vehicle_color'] = vehicle.get('color')
+
+                    plate = vehicle.get('plate')
+                    if plate:
+                        values['vehicle_plate'] = format_license_plate(plate)
+
+                    self.stats['vehicles_found'] += 1
+                    break  # Only take first vehicle
+
+        return values
+
+    def store_results(self, results: List[Tuple[int, Optional[Dict]]]):
+        """
+        Write extracted data into the dataframe as whole columns
+
+        Args:
+            results: (index, extracted data) pairs in any order; extracted data
+                is None for rows that could not be processed
+        """
+        indices = []
+        records = []
+
+        for idx, extracted in results:
+            if extracted is None:
+                self.stats['failed'] += 1
+                continue
+
+            try:
+                records.append(self.flatten_extraction(extracted))
+                indices.append(idx)
+                self.stats['successful'] += 1
+            except Exception as e:
+                print(f"\n❌ Error processing row {idx}: {e}")
+                self.stats['failed'] += 1
+
+        extracted_df = pd.DataFrame(records, index=indices, columns=EXTRACTED_COLUMNS)
+        self.df[EXTRACTED_COLUMNS] = extracted_df.reindex(self.df.index).astype('string')
+
+    def load_checkpoint(self) -> Dict[int, Dict]:
+        """
+        Load rows extracted by an earlier, interrupted run
+
+        Returns:
+            Extracted data keyed by row index; empty if there is no checkpoint
+            or it was written for a different (or since modified) input file
+        """
+        if not os.path.exists(self.checkpoint_file):
+            return {}
+
+        done = {}
+        with open(self.checkpoint_file, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            first = next(reader, None)
+            if first is None or first != {'index': CHECKPOINT_INPUT_ROW, 'extracted': self.input_identity()}:
+                return {}
+
+            for row in reader:
+                try:
+                    done[int(row['index'])] = orjson.loads(row['extracted'])
+                except (KeyError, TypeError, ValueError):
+                    # A line cut short when the previous run was killed
+                    continue
+
+        return done
+
+    def input_identity(self) -> str:
+        """Identify the input file by absolute path, size and modification time"""
+        stat = os.stat(self.input_file)
+        return orjson.dumps({
+            'path': os.path.abspath(self.input_file),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns
+        }).decode('utf-8')
+
+    def write_checkpoint(self, checkpoint: csv.DictWriter, results: Iterable[Tuple[int, Dict]]):
+        """
+        Append extracted rows to the checkpoint file
+        Regex fallbacks for failed LLM requests are left out, so a resumed run
+        sends those rows to the LLM again
+        """
+        for idx, extracted in results:
+            if extracted.get('llm_failed'):
+                continue
+            checkpoint.writerow({'index': idx, 'extracted': orjson.dumps(extracted).decode('utf-8')})
+
+    def process_with_batch_api(self, inputs: List[Tuple[int, str, str]]) -> Optional[List[Tuple[int, Dict]]]:
+        """
+        Extract all rows through the DeepSeek batch API
 
         Args:
-            idx: Row index
-            row: Row data
+            inputs: (index, crime code, narrative) for each row
 
         Returns:
-            True if successful, False if failed
+            (index, extracted data) for every row, or None if the batch API is
+            unavailable
         """
+        # Reports already in the cache are not submitted again
+        cached = cached_extractions(inputs)
+        pending = [row for row in inputs if row[0] not in cached]
+
+        extracted = {}
+        batch_id = self.batch_id
         try:
-            crime_code = str(row[config.INPUT_COLUMNS['crime_code']])
-            narrative = str(row[config.INPUT_COLUMNS['narrative']])
-
-            # Skip if narrative is empty
-            if not narrative or narrative.lower() in ['nan', 'none', '']:
-                return False
-
-            # Extract using LLM (with fallback to regex)
-            extracted = extract_with_llm_safe(narrative, crime_code)
-
-            # Method of entry
-            if extracted.get('method_of_entry'):
-                self.df.at[idx, 'method_of_entry'] = extracted['method_of_entry']
-                self.stats['method_extracted'] += 1
-
-            # Suspects
-            if extracted.get('suspects') and isinstance(extracted['suspects'], list):
-                for i, suspect in enumerate(extracted['suspects'][:2]):  # Max 2 suspects
-                    if isinstance(suspect, dict) and 'description' in suspect:
-                        desc = clean_suspect_description(suspect['description'])
-                        if desc:
-                            col_name = f'suspect_{i+1}'
-                            self.df.at[idx, col_name] = desc
-                            if i == 0:  # Count only if at least one suspect found
-                                self.stats['suspects_found'] += 1
-
-            # Vehicles
-            if extracted.get('vehicles') and isinstance(extracted['vehicles'], list):
-                # Take first vehicle if multiple
-                for vehicle in extracted['vehicles']:
-                    if isinstance(vehicle, dict) and any(vehicle.values()):
-                        self.df.at[idx, 'vehicle_make'] = vehicle.get('make')
-                        self.df.at[idx, 'vehicle_model'] = vehicle.get('model')
-                        self.df.at[idx, 'vehicle_color'] = vehicle.get('color')
-
-                        plate = vehicle.get('plate')
-                        if plate:
-                            self.df.at[idx, 'vehicle_plate'] = format_license_plate(plate)
-
-                        self.stats['vehicles_found'] += 1
-                        break  # Only take first vehicle
-
-            return True
+            if batch_id is None and pending:
+                print(f"📤 Submitting {len(pending)} reports to the batch API...")
+                batch_id = submit_batch(pending)
+
+            if batch_id is not None:
+                print(f"⏳ Waiting for batch {batch_id} (checking every {config.BATCH_POLL_INTERVAL}s)...")
+                extracted = download_batch_results(wait_for_batch(batch_id), pending)
 
         except Exception as e:
-            print(f"\n❌ Error processing row {idx}: {e}")
-            return False
+            if batch_id is None or isinstance(e, BatchFailedError):
+                # Nothing is left running server-side
+                print(f"⚠️  Batch API unavailable: {e}")
+                print("   Falling back to direct LLM requests...")
+                return None
+
+            # The job may still be running (and billing); don't resubmit
+            # its rows as direct requests
+            print(f"❌ Error waiting for batch {batch_id}: {e}")
+            print(f"   To pick it up again, rerun with: --batch-id {batch_id}")
+            sys.exit(1)
+
+        # Reports missing from the batch output fall back to regex
+        return [
+            (idx, cached.get(idx) or extracted.get(str(idx)) or llm_fallback_extraction(narrative))
+            for idx, _, narrative in inputs
+        ]
 
     def process_all(self):
         """Process all crime reports"""
@@ -160,21 +384,101 @@ class CrimeReportExtractor:
 
         self.stats['total_rows'] = len(self.df)
 
-        # Process each row with progress indicator
-        for idx, row in self.df.iterrows():
-            # Progress indicator every 10 rows
-            if (idx + 1) % 10 == 0 or idx == 0:
-                print(f"Progress: {idx + 1}/{len(self.df)} rows processed...", end='\r')
-
-            success = self.process_row(idx, row)
-            if success:
-                self.stats['successful'] += 1
+        inputs = self.get_row_inputs()
+
+        # Rows with an empty narrative can't be extracted
+        with_narrative = {idx for idx, _, _ in inputs}
+        results = [(idx, None) for idx in self.df.index if idx not in with_narrative]
+
+        # Rows finished by an interrupted earlier run are not extracted again
+        # (unless cached results are being refreshed)
+        done = self.load_checkpoint() if self.use_cache else {}
+        if done:
+            print(f"♻️  Resuming: {len(done)} rows already extracted in {self.checkpoint_file}")
+            results.extend((idx, extracted) for idx, extracted in done.items() if idx in with_narrative)
+            inputs = [row for row in inputs if row[0] not in done]
+
+        # Try the cheap regex extraction first; only rows it can't fully
+        # answer are sent to the LLM
+        llm_inputs = []
+        for idx, crime_code, narrative in inputs:
+            # Stubs like 'Report pending' have nothing to extract
+            if is_trivial_narrative(narrative):
+                results.append((idx, empty_extraction()))
+                self.stats['llm_skipped'] += 1
+                continue
+
+            # Short narratives aren't worth an LLM request; regex gets what's there
+            cheap = fallback_regex_extraction(narrative)
+            if len(narrative) >= config.MIN_NARRATIVE_LENGTH and needs_llm(cheap, crime_code, narrative):
+                llm_inputs.append((idx, crime_code, narrative))
             else:
-                self.stats['failed'] += 1
+                results.append((idx, cheap))
+                self.stats['llm_skipped'] += 1
+
+        os.makedirs(os.path.dirname(self.checkpoint_file) or '.', exist_ok=True)
+        with open(self.checkpoint_file, 'w', newline='', encoding='utf-8') as f:
+            # Rewrite the rows loaded above rather than appending, which drops
+            # any line left half-written by the interrupted run
+            checkpoint = csv.DictWriter(f, fieldnames=CHECKPOINT_FIELDS)
+            checkpoint.writeheader()
+            checkpoint.writerow({'index': CHECKPOINT_INPUT_ROW, 'extracted': self.input_identity()})
+            self.write_checkpoint(checkpoint, done.items())
+
+            llm_results = None
+            if self.use_batch_api and llm_inputs:
+                llm_results = self.process_with_batch_api(llm_inputs)
+                if llm_results is not None:
+                    self.write_checkpoint(checkpoint, llm_results)
+
+            if llm_results is None:
+                # Split rows into batches, one LLM request per batch
+                batches = [llm_inputs[start:start + config.BATCH_SIZE]
+                           for start in range(0, len(llm_inputs), config.BATCH_SIZE)]
+
+                # Batches are I/O bound, so run several LLM requests concurrently
+                llm_results = []
+                with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
+                    futures = [executor.submit(self.process_batch, batch) for batch in batches]
+                    for future in as_completed(futures):
+                        batch_results = future.result()
+                        llm_results.extend(batch_results)
+                        # Checkpoint batches as they finish, so a crash loses
+                        # at most the batches still in flight
+                        self.write_checkpoint(checkpoint, batch_results)
+                        f.flush()
+                        # Progress indicator once per batch
+                        print(f"Progress: {len(results) + len(llm_results)}/{len(self.df)} rows processed...", end='\r')
+
+        self.store_results(results + llm_results)
 
         print(f"\nProgress: {len(self.df)}/{len(self.df)} rows processed... ✅")
         print("=" * 70)
 
+    def write_excel(self):
+        """
+        Write the dataframe to Excel one row at a time
+
+        Uses xlsxwriter's constant_memory mode, which flushes each row to disk
+        as it is written instead of building the whole workbook in memory.
+        pandas' to_excel() can't be used for this: it writes column by column,
+        and constant_memory mode drops cells written to earlier rows.
+        Dates get a default format, as to_excel() would give them, so they
+        don't show up as bare serial numbers.
+        """
+        workbook = xlsxwriter.Workbook(
+            self.output_file,
+            {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'}
+        )
+        worksheet = workbook.add_worksheet()
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+
+        worksheet.write_row(0, 0, list(self.df.columns), header_format)
+        for row_num, row in enumerate(self.df.itertuples(index=False, name=None), 1):
+            worksheet.write_row(row_num, 0, [None if pd.isna(value) else value for value in row])
+
+        workbook.close()
+
     def save_output(self):
         """Save processed data to Excel"""
         print(f"\n💾 Saving results to: {self.output_file}")
@@ -184,7 +488,7 @@ class CrimeReportExtractor:
             os.makedirs(os.path.dirname(self.output_file), exist_ok=True)
 
             # Save to Excel
-            self.df.to_excel(self.output_file, index=False, engine='openpyxl')
+            self.write_excel()
             print(f"✅ Successfully saved {len(self.df)} rows to {self.output_file}")
 
             # Also save as CSV for easier inspection
@@ -192,6 +496,10 @@ class CrimeReportExtractor:
             self.df.to_csv(csv_file, index=False)
             print(f"✅ Also saved as CSV: {csv_file}")
 
+            # The full output is saved, so the checkpoint is no longer needed
+            if os.path.exists(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+
         except Exception as e:
             print(f"❌ Error saving output: {e}")
             sys.exit(1)
@@ -206,6 +514,7 @@ class CrimeReportExtractor:
         print(f"   Total rows processed:    {self.stats['total_rows']}")
         print(f"   Successful extractions:  {self.stats['successful']}")
         print(f"   Failed extractions:      {self.stats['failed']}")
+        print(f"   Answered without LLM:    {self.stats['llm_skipped']}")
 
         print(f"\n🔍 Extraction Details:")
 
@@ -270,6 +579,12 @@ def main():
     parser.add_argument('-i', '--input', help='Input Excel file path', default=None)
     parser.add_argument('-o', '--output', help='Output Excel file path', default=None)
     parser.add_argument('-c', '--codes', help='Crime codes CSV file path', default=None)
+    parser.add_argument('--batch', action='store_true',
+                        help='Use the DeepSeek batch API (lower cost, results can take hours)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore cached LLM extractions and any checkpoint, and re-extract every report')
+    parser.add_argument('--batch-id', default=None,
+                        help='Wait for an already submitted batch API job instead of submitting a new one')
 
     args = parser.parse_args()
 
@@ -277,7 +592,10 @@ def main():
     extractor = CrimeReportExtractor(
         input_file=args.input,
         output_file=args.output,
-        crime_codes_file=args.codes
+        crime_codes_file=args.codes,
+        use_batch_api=args.batch,
+        use_cache=not args.no_cache,
+        batch_id=args.batch_id
     )
 
     extractor.run()
@@ -0,0 +1,151 @@
+"""
+Tests for checkpointing and resuming interrupted runs
+Run with: python -m unittest test_checkpoint
+"""
+
+import csv
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import main
+
+NARRATIVES = [
+    'Suspect broke the rear window to gain entry overnight.',
+    'Suspect pried the front door open with a screwdriver.',
+    'S1 kicked in the side door, fled on foot northbound.',
+]
+
+
+def llm_batch(pairs):
+    """Stand-in for extract_with_llm_batch that tags each narrative"""
+    return [
+        {'method_of_entry': f'llm {narrative[:10]}', 'suspects': [], 'vehicles': []}
+        for _, narrative in pairs
+    ]
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.input_file = self.write_input('input.xlsx', NARRATIVES)
+        self.output_file = os.path.join(self.dir, 'output', 'out.xlsx')
+
+        patcher = mock.patch('builtins.print')
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def write_input(self, name: str, narratives) -> str:
+        path = os.path.join(self.dir, name)
+        pd.DataFrame({'crime_code': ['220'] * len(narratives), 'narrative': narratives}).to_excel(path, index=False)
+        return path
+
+    def run_extractor(self, batch_function, input_file: str = None, use_cache: bool = True) -> main.CrimeReportExtractor:
+        """Run the processing step (without saving) with the given batch function"""
+        with mock.patch('main.set_cache_reads'):
+            extractor = main.CrimeReportExtractor(
+                input_file=input_file or self.input_file,
+                output_file=self.output_file,
+                crime_codes_file=os.path.join(self.dir, 'missing.csv'),
+                use_cache=use_cache
+            )
+        with mock.patch('main.extract_with_llm_batch', side_effect=batch_function) as batch:
+            extractor.load_data()
+            extractor.initialize_output_columns()
+            extractor.process_all()
+        self.calls = batch.call_count
+        return extractor
+
+    def test_resume_skips_checkpointed_rows(self):
+        first = self.run_extractor(llm_batch)
+        self.assertTrue(os.path.exists(first.checkpoint_file))
+
+        second = self.run_extractor(llm_batch)
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(second.df['method_of_entry'].tolist(), first.df['method_of_entry'].tolist())
+
+    def test_checkpoint_for_other_input_is_ignored(self):
+        self.run_extractor(llm_batch)
+        other = self.write_input('other.xlsx', ['Suspect smashed the window of the garage door today.'])
+
+        extractor = self.run_extractor(llm_batch, input_file=other)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(extractor.df['method_of_entry'].tolist(), ['llm Suspect sm'])
+
+    def test_checkpoint_for_modified_input_is_ignored(self):
+        self.run_extractor(llm_batch)
+        changed = list(reversed(NARRATIVES))
+        self.write_input('input.xlsx', changed)
+
+        resent = []
+        self.run_extractor(lambda pairs: resent.extend(pairs) or llm_batch(pairs))
+        self.assertEqual([narrative for _, narrative in resent], changed)
+
+    def test_failed_llm_rows_are_retried_on_resume(self):
+        def failing_batch(pairs):
+            results = llm_batch(pairs)
+            results[1] = dict(results[1], llm_failed=True)
+            return results
+
+        self.run_extractor(failing_batch)
+
+        resent = []
+        self.run_extractor(lambda pairs: resent.extend(pairs) or llm_batch(pairs))
+        self.assertEqual([narrative for _, narrative in resent], [NARRATIVES[1]])
+
+    def test_truncated_line_is_dropped(self):
+        first = self.run_extractor(llm_batch)
+        with open(first.checkpoint_file, 'rb+') as f:
+            f.truncate(os.path.getsize(first.checkpoint_file) - 20)
+
+        resent = []
+        self.run_extractor(lambda pairs: resent.extend(pairs) or llm_batch(pairs))
+        self.assertEqual([narrative for _, narrative in resent], [NARRATIVES[2]])
+
+    def test_no_cache_ignores_checkpoint(self):
+        self.run_extractor(llm_batch)
+
+        resent = []
+        self.run_extractor(lambda pairs: resent.extend(pairs) or llm_batch(pairs), use_cache=False)
+        self.assertEqual([narrative for _, narrative in resent], NARRATIVES)
+
+    def test_batches_are_checkpointed_as_they_finish(self):
+        checkpoint_file = self.output_file + '.partial.csv'
+
+        def checkpointed_rows() -> int:
+            with open(checkpoint_file, newline='', encoding='utf-8') as f:
+                return sum(1 for row in csv.DictReader(f) if row['index'] != main.CHECKPOINT_INPUT_ROW)
+
+        def stalling_batch(pairs):
+            # The first batch hangs until the later ones are checkpointed, then the run dies
+            if pairs[0][1] == NARRATIVES[0]:
+                deadline = time.monotonic() + 5
+                while checkpointed_rows() < 2 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                raise KeyboardInterrupt
+            return llm_batch(pairs)
+
+        with mock.patch('config.BATCH_SIZE', 1), mock.patch('config.MAX_WORKERS', 3):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_extractor(stalling_batch)
+
+        resent = []
+        self.run_extractor(lambda pairs: resent.extend(pairs) or llm_batch(pairs))
+        self.assertEqual([narrative for _, narrative in resent], [NARRATIVES[0]])
+
+    def test_save_output_removes_checkpoint(self):
+        extractor = self.run_extractor(llm_batch)
+        extractor.save_output()
+        self.assertFalse(os.path.exists(extractor.checkpoint_file))
+        self.assertTrue(os.path.exists(self.output_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
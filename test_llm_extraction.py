@@ -0,0 +1,230 @@
+"""
+Tests for the LLM request path, against a mocked DeepSeek session
+Run with: python -m unittest test_llm_extraction
+"""
+
+import io
+import unittest
+from unittest import mock
+
+import orjson
+import requests
+
+import extractors
+
+
+def make_response(status_code: int = 200, body: bytes = b'') -> requests.Response:
+    """Build a requests.Response that streams the given body"""
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = 'Test'
+    response.url = extractors._API_URL
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def sse_body(content: str, chunk_size: int = 7, trailer: str = '') -> bytes:
+    """Encode chat completion content as server-sent event deltas"""
+    chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+    if trailer:
+        chunks.append(trailer)
+    events = [
+        b'data: ' + orjson.dumps({'choices': [{'delta': {'content': chunk}}]}) + b'\n\n'
+        for chunk in chunks
+    ]
+    return b''.join(events) + b'data: [DONE]\n\n'
+
+
+def extraction(method: str) -> dict:
+    return {'method_of_entry': method, 'suspects': [], 'vehicles': []}
+
+
+class LLMTestCase(unittest.TestCase):
+    """Patches out the network, sleeping, rate limiting and the disk cache"""
+
+    def setUp(self):
+        self.post = self.patch('extractors._SESSION.post')
+        self.patch('extractors.time.sleep')
+        self.patch('extractors._RATE_LIMITER', extractors.RateLimiter(0))
+        self.patch('extractors._cache_get', return_value=None)
+        self.patch('extractors._cache_set')
+        self.patch('builtins.print')
+
+    def patch(self, target: str, *args, **kwargs):
+        patcher = mock.patch(target, *args, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+
+class ReadJsonStreamTest(unittest.TestCase):
+
+    def test_joins_deltas(self):
+        response = make_response(body=sse_body('{"method_of_entry": "door pry"}'))
+        self.assertEqual(extractors._read_json_stream(response), {'method_of_entry': 'door pry'})
+
+    def test_stops_after_complete_json(self):
+        body = sse_body('{"a": 1}', trailer=' and some more text')
+        body += b'data: ' + b'x' * 100 + b'\n\n'  # Would fail to parse if it were read
+        response = make_response(body=body)
+        self.assertEqual(extractors._read_json_stream(response), {'a': 1})
+
+    def test_truncated_output_raises(self):
+        response = make_response(body=sse_body('{"method_of_entry": "door'))
+        with self.assertRaises(ValueError):
+            extractors._read_json_stream(response)
+
+    def test_ignores_keepalives_and_empty_deltas(self):
+        body = b': keep-alive\n\n' + b'data: {"choices": [{"delta": {}}]}\n\n' + sse_body('{"a": 1}')
+        self.assertEqual(extractors._read_json_stream(make_response(body=body)), {'a': 1})
+
+
+class RequestClassificationTest(LLMTestCase):
+
+    def test_retryable_status(self):
+        for status in extractors.RETRYABLE_STATUS_CODES:
+            self.post.return_value = make_response(status)
+            with self.assertRaises(extractors._RetryableError):
+                extractors._request_llm([], 10)
+
+    def test_connection_error_is_retryable(self):
+        self.post.side_effect = requests.ConnectionError('reset')
+        with self.assertRaises(extractors._RetryableError):
+            extractors._request_llm([], 10)
+
+    def test_client_error_is_permanent(self):
+        self.post.return_value = make_response(401)
+        with self.assertRaises(requests.HTTPError):
+            extractors._request_llm([], 10)
+
+    def test_safe_extraction_retries_transient_failures(self):
+        self.post.side_effect = [make_response(503), make_response(body=sse_body('{"method_of_entry": "door pry"}'))]
+        result = extractors.extract_with_llm_safe('Suspect pried the rear door open.', '220', retries=3)
+        self.assertEqual(result['method_of_entry'], 'door pry')
+        self.assertEqual(self.post.call_count, 2)
+
+    def test_safe_extraction_does_not_retry_permanent_failures(self):
+        self.post.side_effect = lambda *args, **kwargs: make_response(401)
+        result = extractors.extract_with_llm_safe('Suspect pried the rear door open.', '220', retries=3)
+        self.assertEqual(self.post.call_count, 1)
+        self.assertTrue(result['llm_failed'])
+        self.assertEqual(result['method_of_entry'], 'door pry')
+
+
+class PromptFieldsTest(LLMTestCase):
+
+    def system_prompt(self, narrative: str, crime_code: str) -> str:
+        return extractors.build_extraction_messages(narrative, crime_code)[0]['content']
+
+    def test_vehicle_codes_always_ask_for_vehicles(self):
+        narrative = 'Victim states the 911 parked in the driveway was gone in the morning.'
+        self.assertIn('"vehicles"', self.system_prompt(narrative, '510'))
+        self.assertNotIn('"vehicles"', self.system_prompt(narrative, '740'))
+
+    def test_suspect_codes_always_ask_for_suspects(self):
+        narrative = 'Victim returned home and found the rear door open and jewelry gone.'
+        self.assertIn('"suspects"', self.system_prompt(narrative, '459'))
+
+    def test_suspect_hints(self):
+        for narrative in [
+            'Susp entered through the unlocked rear door.',
+            'W/M grabbed the purse and ran.',
+            'Perp took the laptop from the counter.',
+            'Unknown person entered the garage.',
+            'Two juveniles threw rocks at the window.',
+            "Victim's caretaker removed cash from the dresser.",
+        ]:
+            self.assertIn('"suspects"', self.system_prompt(narrative, '740'), narrative)
+
+    def test_batch_prompt_covers_every_report(self):
+        pairs = [('740', 'Window was broken overnight.'), ('330', 'Mustang was broken into overnight.')]
+        system = extractors.build_batch_messages(pairs)[0]['content']
+        self.assertIn('"vehicles"', system)
+
+    def test_model_output_is_kept_without_hints(self):
+        # Nothing in the narrative names a vehicle, but the model found one
+        result = extraction('unknown')
+        result['vehicles'] = [{'make': 'Porsche', 'model': '911'}]
+        self.post.return_value = make_response(body=sse_body(orjson.dumps(result).decode()))
+        extracted = extractors.extract_with_llm('The 911 was taken from the driveway.', '740')
+        self.assertEqual(extracted['vehicles'], [{'make': 'Porsche', 'model': '911'}])
+
+
+class BatchExtractionTest(LLMTestCase):
+
+    pairs = [
+        ('220', 'Suspect broke the rear window to gain entry.'),
+        ('220', 'Suspect pried the front door open.'),
+    ]
+
+    def test_batch_results_in_order(self):
+        reports = {'reports': [extraction('window smash'), extraction('door pry')]}
+        self.post.return_value = make_response(body=sse_body(orjson.dumps(reports).decode()))
+        results = extractors.extract_with_llm_batch(self.pairs)
+        self.assertEqual([r['method_of_entry'] for r in results], ['window smash', 'door pry'])
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_length_mismatch_falls_back_to_single_reports(self):
+        short = {'reports': [extraction('window smash')]}
+        self.post.side_effect = [
+            make_response(body=sse_body(orjson.dumps(short).decode())),
+            make_response(body=sse_body(orjson.dumps(extraction('window smash')).decode())),
+            make_response(body=sse_body(orjson.dumps(extraction('door pry')).decode())),
+        ]
+        results = extractors.extract_with_llm_batch(self.pairs)
+        self.assertEqual([r['method_of_entry'] for r in results], ['window smash', 'door pry'])
+        # The malformed batch is not resent
+        self.assertEqual(self.post.call_count, 3)
+
+    def test_exhausted_transient_retries_fall_back_to_regex(self):
+        self.post.side_effect = lambda *args, **kwargs: make_response(429)
+        results = extractors.extract_with_llm_batch(self.pairs)
+        # No per-report requests while the server is shedding load
+        self.assertEqual(self.post.call_count, extractors._MAX_RETRIES)
+        self.assertTrue(all(r['llm_failed'] for r in results))
+        self.assertEqual([r['method_of_entry'] for r in results], ['window smash', 'door pry'])
+
+    def test_cached_reports_are_not_sent(self):
+        cache = {self.pairs[0][1]: extraction('cached')}
+        with mock.patch('extractors._cache_get', side_effect=lambda narrative, crime_code: cache.get(narrative)):
+            self.post.return_value = make_response(body=sse_body(orjson.dumps(extraction('door pry')).decode()))
+            results = extractors.extract_with_llm_batch(self.pairs)
+        self.assertEqual([r['method_of_entry'] for r in results], ['cached', 'door pry'])
+        self.assertNotIn('llm_failed', results[1])
+        self.assertEqual(self.post.call_count, 1)
+
+
+class BatchDownloadTest(LLMTestCase):
+
+    rows = [(0, '220', 'Suspect pried the front door open.')]
+
+    def test_downloads_output_file(self):
+        line = {
+            'custom_id': '0',
+            'response': {'status_code': 200, 'body': {'choices': [{'message': {'content': orjson.dumps(extraction('door pry')).decode()}}]}}
+        }
+        get = self.patch('extractors._SESSION.get', return_value=make_response(body=orjson.dumps(line) + b'\n'))
+        results = extractors.download_batch_results({'id': 'b1', 'output_file_id': 'f1'}, self.rows)
+        self.assertEqual(results['0']['method_of_entry'], 'door pry')
+        self.assertIn('/files/f1/content', get.call_args.args[0])
+
+    def test_missing_output_file(self):
+        get = self.patch('extractors._SESSION.get')
+        batch = {'id': 'b1', 'status': 'completed', 'output_file_id': None, 'error_file_id': 'f2'}
+        self.assertEqual(extractors.download_batch_results(batch, self.rows), {})
+        get.assert_not_called()
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def test_key_depends_on_model_and_prompt(self):
+        key = extractors._cache_key('Suspect pried the front door open.', '220')
+        self.assertEqual(extractors._cache_key('Suspect pried the front door open.', '220'), key)
+        with mock.patch('extractors._MODEL', 'other-model'):
+            self.assertNotEqual(extractors._cache_key('Suspect pried the front door open.', '220'), key)
+        with mock.patch('extractors._PROMPT_VERSION', 'other-prompt'):
+            self.assertNotEqual(extractors._cache_key('Suspect pried the front door open.', '220'), key)
+        self.assertNotEqual(extractors._cache_key('Suspect pried the front door open.', '459'), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Tests for writing the output workbook
+Run with: python -m unittest test_output
+"""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import openpyxl
+import pandas as pd
+
+import main
+
+
+class WriteExcelTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.output_file = os.path.join(tmp.name, 'out.xlsx')
+
+    def write(self, df: pd.DataFrame):
+        """Write the dataframe and return the first worksheet read back"""
+        extractor = main.CrimeReportExtractor(
+            input_file='unused.xlsx',
+            output_file=self.output_file,
+            crime_codes_file='unused.csv'
+        )
+        extractor.df = df
+        extractor.write_excel()
+        return openpyxl.load_workbook(self.output_file).active
+
+    def test_dates_round_trip(self):
+        when = datetime(2024, 3, 5, 14, 30)
+        sheet = self.write(pd.DataFrame({'date_occurred': [when, pd.NaT], 'narrative': ['a', 'b']}))
+
+        cell = sheet['A2']
+        self.assertEqual(cell.value, when)
+        self.assertTrue(cell.is_date)
+        self.assertEqual(cell.number_format, 'yyyy-mm-dd hh:mm:ss')
+        self.assertIsNone(sheet['A3'].value)
+
+    def test_header_and_values(self):
+        sheet = self.write(pd.DataFrame({'crime_code': [220, 459], 'method_of_entry': ['door pry', None]}))
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(rows, [('crime_code', 'method_of_entry'), (220, 'door pry'), (459, None)])
+
+
+class CrimeCodeTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def load(self, crime_codes) -> main.CrimeReportExtractor:
+        input_file = os.path.join(self.dir, 'input.xlsx')
+        narratives = [f'Narrative {i}' for i in range(len(crime_codes))]
+        pd.DataFrame({'crime_code': crime_codes, 'narrative': narratives}).to_excel(input_file, index=False)
+        codes_file = os.path.join(self.dir, 'codes.csv')
+        pd.DataFrame({'code': ['220', '459'], 'description': ['Burglary', 'Residential burglary']}).to_csv(codes_file, index=False)
+
+        extractor = main.CrimeReportExtractor(
+            input_file=input_file,
+            output_file=os.path.join(self.dir, 'out.xlsx'),
+            crime_codes_file=codes_file
+        )
+        with mock.patch('builtins.print'):
+            extractor.load_data()
+        extractor.initialize_output_columns()
+        return extractor
+
+    def test_codes_match_as_strings(self):
+        extractor = self.load([220, None, 459])
+        self.assertEqual(extractor.crime_code_strings().tolist(), ['220', '', '459'])
+        self.assertEqual([code for _, code, _ in extractor.get_row_inputs()], ['220', '', '459'])
+        self.assertEqual(extractor.df['crime_type'].tolist()[::2], ['Burglary', 'Residential burglary'])
+
+    def test_numeric_codes_stay_numbers_in_output(self):
+        extractor = self.load([220, 459])
+        extractor.write_excel()
+        sheet = openpyxl.load_workbook(extractor.output_file).active
+        self.assertEqual([sheet['A2'].value, sheet['A3'].value], [220, 459])
+
+    def test_text_codes_are_kept(self):
+        extractor = self.load(['220', '0459A'])
+        self.assertEqual(extractor.crime_code_strings().tolist(), ['220', '0459A'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Tests for routing narratives between the empty, regex and LLM tiers
+Run with: python -m unittest test_tiers
+"""
+
+import unittest
+
+import extractors
+
+
+class TrivialNarrativeTest(unittest.TestCase):
+
+    def test_stubs_are_trivial(self):
+        for narrative in ['Report pending', 'See supplemental', 'N/A', 'Refer to case file.']:
+            with self.subTest(narrative=narrative):
+                self.assertTrue(extractors.is_trivial_narrative(narrative))
+
+    def test_real_narratives_are_not_trivial(self):
+        narratives = [
+            'Victim punched by a tall man in a red hoodie near the park, fled on foot.',
+            'Woman grabbed purse from victim at bus stop and ran toward Main St.',
+            'Two juveniles seen running from the residence with a TV.',
+            'Residence burglarized while owners were on vacation; jewelry missing.',
+            'See supplemental report for details on this case.',
+        ]
+        for narrative in narratives:
+            with self.subTest(narrative=narrative):
+                self.assertFalse(extractors.is_trivial_narrative(narrative))
+
+    def test_short_narratives_with_content_are_not_trivial(self):
+        for narrative in ['Suspect pried door, fled.', 'Honda stolen.', 'W/M took wallet.']:
+            with self.subTest(narrative=narrative):
+                self.assertFalse(extractors.is_trivial_narrative(narrative))
+
+
+class NeedsLLMTest(unittest.TestCase):
+
+    def route(self, narrative: str, crime_code: str) -> bool:
+        regex_result = extractors.fallback_regex_extraction(narrative)
+        return extractors.needs_llm(regex_result, crime_code, narrative)
+
+    def test_burglary_without_suspects_stays_on_regex(self):
+        narrative = 'Unknown entry through the rear window, which was smashed. Jewelry and cash taken.'
+        self.assertFalse(self.route(narrative, '459'))
+        self.assertFalse(self.route(narrative, '220'))
+
+    def test_described_suspects_go_to_llm(self):
+        narrative = 'Susp smashed the rear window and took jewelry. W/M, 6 ft, dark hoodie.'
+        self.assertTrue(self.route(narrative, '459'))
+
+    def test_unknown_entry_method_goes_to_llm(self):
+        self.assertTrue(self.route('Victim returned home to find the television and laptop gone.', '740'))
+
+    def test_vehicle_crime_without_vehicle_details_goes_to_llm(self):
+        narrative = 'Someone smashed the rear window and took the stereo overnight from the driveway.'
+        self.assertTrue(self.route(narrative, '330'))
+        self.assertFalse(self.route(narrative, '740'))
+
+
+if __name__ == '__main__':
+    unittest.main()